@@ -1,96 +1,549 @@
-import requests
-import concurrent.futures # For multithreading
+import asyncio # For multiplexing thousands of proxy tests on a single event loop
+import concurrent.futures # For resolving proxy host names in parallel before testing
+import ipaddress # To tell IP addresses from host names
+import itertools # For rotating through the test endpoints
+import multiprocessing # For the queue that carries results back from worker processes
+import os # For the CPU count
+import queue # For handing progress lines to the output thread
 import re # For parsing different proxy formats
-import time # For time.sleep for politeness, and latency calculation
-from urllib.parse import urlparse # Useful for structured parsing, though regex handles most here
+import socket # For resolving host names once, up front
+import statistics # For the median latency over several probes
+import sys # For batched writes to stdout
+import threading # For the thread that writes progress to stdout
+import time # For latency calculation (monotonic, nanosecond clock)
+from collections import deque # For the rolling window of recent latencies
+from contextlib import aclosing, contextmanager # aclosing makes sure an early exit cancels the remaining tests
+from dataclasses import dataclass, replace # For the pre-parsed proxy records
+from urllib.parse import urlsplit, urlunsplit # For swapping the test host for its IP
+
+import aiohttp # Async HTTP client
+from aiohttp_socks import ProxyConnectionError, ProxyConnector, ProxyError, ProxyTimeoutError # Handles HTTP, SOCKS4 and SOCKS5 proxies uniformly
+
+try:
+    from orjson import loads as json_loads # Faster bytes-to-dict JSON parsing; optional, only used by JSON test services
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    import uvloop # Faster libuv-based event loop; optional and not available on Windows
+except ImportError:
+    uvloop = None
+
+# uvloop.run (uvloop 0.18+) is a drop-in for asyncio.run that uses the faster loop when it is installed;
+# an older uvloop without it falls back to the stock loop
+run_event_loop = getattr(uvloop, 'run', None) or asyncio.run
 
 # --- Configuration ---
-TEST_URL = 'http://httpbin.org/ip' # A reliable service that returns the public IP seen by the server
+# Services that return just the public IP seen by the server, as plain text or as JSON
+# like {"origin": "IP"} (httpbin.org/ip) or {"ip": "IP"} (api.ipify.org/?format=json).
+# Proxies are spread over them in turn, so no single service is hammered and one that blocks
+# a proxy network cannot make all of its proxies look dead.
+TEST_URLS = ['http://checkip.amazonaws.com/', 'http://api.ipify.org/', 'http://icanhazip.com/']
 TIMEOUT = 15 # seconds - Increased slightly for potentially slower proxies
-MAX_WORKERS = 50 # Adjust based on your VPS CPU/network and bandwidth.
-                 # Too high might overwhelm your own connection or the target server.
-                 # 50-100 is a good starting point for 1.5k proxies.
+CONNECT_TIMEOUT = 3 # seconds - A live proxy accepts a bare TCP connection well within this
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=TIMEOUT, sock_connect=CONNECT_TIMEOUT) # Used until the adaptive timeout kicks in
+MIN_TIMEOUT = 3 # seconds - The adaptive timeout never goes below this
+ADAPTIVE_TIMEOUT_SAMPLES = 32 # Successful requests needed before the timeout adapts to observed latencies
+MAX_RESPONSE_BYTES = 2048 # Room for a pretty-printed JSON answer listing several hops; nothing beyond this is read from the response
+OUTPUT_BATCH_SIZE = 64 # Result lines are written to stdout in batches of up to this many
+PROBES_PER_PROXY = 3 # Requests sent through each reachable proxy; the median latency is reported
+TARGET_WORKING = None # Stop testing once this many working proxies are found (None tests every proxy)
+MAX_CONCURRENCY = 500 # Maximum number of proxies tested at the same time.
+                      # All tests share one event loop, so this can be far higher than a thread count,
+                      # but too high might overwhelm your own connection or the target server.
+                      # With several processes this total is split evenly between them.
+PROCESSES = os.cpu_count() or 1 # Worker processes, each running its own event loop over a share of the proxies.
+                                # Spreads the Python-level parsing and TLS work over all cores; 1 runs everything here.
+                                # Workers send their latencies to this process, so the adaptive timeout is based on
+                                # all of them (ADAPTIVE_TIMEOUT_SAMPLES counts across workers, not per worker).
+# Using a common User-Agent to appear as a standard browser
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+# Compiled once at import time; matches protocol://[user:pass@]ip:port
+_PROXY_RE = re.compile(r'^(?P<proto>https?|socks[45])://(?:(?P<user>[^:@]+):(?P<password>[^@]+)@)?(?P<ip>[^:]+):(?P<port>\d+)$', re.IGNORECASE)
+# Matches ip:port[:user:pass] (protocol assumed to be http)
+_BARE_RE = re.compile(r'^(?P<ip>[^:]+):(?P<port>\d+)(?::(?P<user>[^:]+):(?P<password>[^:]+))?$')
+
+class InvalidResponseError(Exception):
+    """
+    Raised when a proxy answers the test request, but not with the test service's IP address
+    (e.g. a captive portal or an HTML error page served with status 200).
+    """
+
+class ResultsFileError(Exception):
+    """
+    Raised when a result file cannot be opened or written (e.g. the disk is full),
+    so it is told apart from an OSError raised by the test run itself.
+    """
+
+@dataclass(slots=True, frozen=True)
+class ParsedProxy:
+    """
+    A proxy entry parsed once up front, so the tests themselves do no string work.
+    """
+    original: str # The entry exactly as it appears in the proxy list
+    protocol: str # Upper-cased protocol label for the result line, e.g. "SOCKS4" or "HTTP_ASSUMED"
+    ip: str
+    port: int
+    proxy_url: str # URL handed to aiohttp / aiohttp_socks, including credentials if any
+
+# --- DNS Pre-resolution ---
+def is_ip_address(host):
+    """
+    Returns True if `host` is a literal IPv4/IPv6 address rather than a host name.
+    """
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def resolve_test_url(url):
+    """
+    Resolves the host of `url` once and returns (url, the url with its host replaced by the IP, the original host),
+    so requests tunnelled through SOCKS proxies need no DNS lookup for the test target.
+    """
+    parts = urlsplit(url)
+    target_ip = socket.gethostbyname(parts.hostname)
+    netloc = target_ip if parts.port is None else f"{target_ip}:{parts.port}"
+    return url, urlunsplit(parts._replace(netloc=netloc)), parts.netloc
+
+def resolve_test_urls(urls):
+    """
+    Resolves every test URL with resolve_test_url() and returns the (url, resolved_url, host) targets that resolved.
+    Unresolvable URLs are reported and left out.
+    """
+    test_targets = []
+    for url in urls:
+        try:
+            test_targets.append(resolve_test_url(url))
+        except OSError as e:
+            print(f"Warning: could not resolve the test URL '{url}', skipping it: {e}")
+    return test_targets
+
+def resolve_proxy_hosts(parsed_proxies):
+    """
+    Resolves proxies given by host name to their IPs in parallel, returning the updated list.
+    Hosts that fail to resolve are left as they are; their test reports the failure.
+    """
+    hosts = {p.ip for p in parsed_proxies if not is_ip_address(p.ip)}
+    if not hosts:
+        return parsed_proxies
+
+    def lookup(host):
+        try:
+            return socket.gethostbyname(host)
+        except OSError:
+            return host
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+        resolved = dict(zip(hosts, executor.map(lookup, hosts)))
+
+    updated = []
+    for p in parsed_proxies:
+        if p.ip in resolved:
+            # The proxy URL always ends with "host:port"; swap the host for its IP there
+            host_port = f"{p.ip}:{p.port}"
+            resolved_url = p.proxy_url[:-len(host_port)] + f"{resolved[p.ip]}:{p.port}"
+            p = replace(p, ip=resolved[p.ip], proxy_url=resolved_url)
+        updated.append(p)
+    return updated
+
+# --- Adaptive Timeout ---
+# Latencies (ms) of the most recent successful requests
+_recent_latencies = deque(maxlen=256)
+# Timeout used for the next request
+_current_timeout = REQUEST_TIMEOUT
+# In a worker process: latencies not yet sent to the parent, which pools them from all workers
+# and hands the resulting timeout back. None when running in the parent process.
+_unreported_latencies = None
+
+def current_timeout():
+    """
+    Returns the ClientTimeout for the next request: REQUEST_TIMEOUT until enough requests have succeeded,
+    then twice the p95 of recent successful latencies, kept between MIN_TIMEOUT and TIMEOUT.
+    Dead proxies then stop holding a slot for the full TIMEOUT.
+    """
+    return _current_timeout
+
+def set_timeout(total):
+    """
+    Sets the total timeout (seconds) used for the next requests.
+    """
+    global _current_timeout
+    if total != _current_timeout.total:
+        _current_timeout = aiohttp.ClientTimeout(total=total, sock_connect=CONNECT_TIMEOUT)
+
+def record_latency(latency_ms):
+    """
+    Adds the latency of a successful request to the window and updates the timeout from it.
+    Worker processes only collect latencies for the parent; see take_unreported_latencies().
+    """
+    if _unreported_latencies is not None:
+        _unreported_latencies.append(latency_ms)
+        return
+    _recent_latencies.append(latency_ms)
+    if len(_recent_latencies) >= ADAPTIVE_TIMEOUT_SAMPLES:
+        p95_seconds = statistics.quantiles(_recent_latencies, n=20)[18] / 1000
+        set_timeout(min(TIMEOUT, max(MIN_TIMEOUT, p95_seconds * 2)))
+
+def take_unreported_latencies():
+    """
+    Returns (and forgets) the latencies a worker process has collected since the last call.
+    Only meaningful in a worker process.
+    """
+    global _unreported_latencies
+    latencies, _unreported_latencies = _unreported_latencies, []
+    return latencies
+
+# --- Error Classification ---
+# Failure category for each exception type. describe_error() walks an exception's classes from the most
+# to the least specific, so e.g. aiohttp's ConnectionTimeoutError is a TIMEOUT, not a CONNECTION_ERROR.
+_ERROR_TAGS = {
+    ProxyError: "PROXY_ERROR",
+    aiohttp.ClientProxyConnectionError: "PROXY_ERROR",
+    aiohttp.ClientHttpProxyError: "PROXY_ERROR",
+    ProxyTimeoutError: "TIMEOUT",
+    aiohttp.ServerTimeoutError: "TIMEOUT",
+    asyncio.TimeoutError: "TIMEOUT",
+    TimeoutError: "TIMEOUT",
+    ProxyConnectionError: "CONNECTION_ERROR",
+    aiohttp.ClientConnectionError: "CONNECTION_ERROR",
+    OSError: "CONNECTION_ERROR",
+    aiohttp.ClientResponseError: "HTTP_ERROR",
+    InvalidResponseError: "INVALID_RESPONSE",
+}
+_ERROR_DETAILS = {
+    "PROXY_ERROR": lambda e: f"Check proxy configuration or if it's alive: {e}",
+    "TIMEOUT": lambda e: "Proxy too slow or unresponsive",
+    "CONNECTION_ERROR": lambda e: f"Proxy likely dead or blocked: {e}",
+    "HTTP_ERROR": lambda e: f"Status Code: {e.status} | Reason: {e.message}",
+    "INVALID_RESPONSE": lambda e: f"Proxy did not return the test service's response: {e}",
+}
+
+def describe_error(e):
+    """
+    Returns (error_tag, detail) for an exception raised while testing a proxy.
+    """
+    for cls in type(e).__mro__:
+        error_tag = _ERROR_TAGS.get(cls)
+        if error_tag:
+            return error_tag, _ERROR_DETAILS[error_tag](e)
+    return "UNKNOWN_ERROR", f"An unexpected error occurred: {e}"
 
 # --- Proxy Tester Function ---
-def test_proxy(proxy_string):
+async def check_reachable(ip, port):
+    """
+    Opens and closes a plain TCP connection to the proxy, raising if it is not accepting connections.
     """
-    Tests a single proxy regardless of its protocol (HTTP, HTTPS, SOCKS4, SOCKS5)
-    and handles authentication.
+    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=CONNECT_TIMEOUT)
+    writer.close()
+    await writer.wait_closed()
+
+def extract_public_ip(body):
     """
-    session = requests.Session()
-    # Using a common User-Agent to appear as a standard browser
-    session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'})
+    Returns the IP address from a test service's raw response bytes.
+    Raises InvalidResponseError if the body is not a valid IP address (or JSON holding one).
+    """
+    body = body.strip()
+    ip_bytes = body
+    if body.startswith(b'{'):
+        # JSON services: parse straight from bytes, with no intermediate str decode
+        try:
+            data = json_loads(body)
+        except ValueError:
+            data = None
+        ip = (data.get('origin') or data.get('ip')) if isinstance(data, dict) else None
+        # httpbin lists every hop as "client, proxy"; the first one is the address seen for us
+        ip_bytes = ip.split(',')[0].strip().encode() if isinstance(ip, str) else b''
+    try:
+        return str(ipaddress.ip_address(ip_bytes.decode('ascii')))
+    except ValueError: # Also covers UnicodeDecodeError
+        raise InvalidResponseError(f"no IP address in {body[:32]!r}") from None
+
+async def fetch_public_ip(session, test_target, proxy_url=None):
+    """
+    Requests the (url, resolved_url, host) `test_target` with `session` (optionally through an HTTP proxy)
+    and returns (public_ip, latency in ms).
+    """
+    test_url, resolved_url, host = test_target
+    if proxy_url:
+        # An HTTP proxy routes by the host in the request URI and ignores the Host header,
+        # so it must be given the real name; it resolves that itself
+        request_url, headers = test_url, None
+    else:
+        # SOCKS tunnels (and direct connections) go to the pre-resolved IP, with the name in Host
+        request_url, headers = resolved_url, {'Host': host}
+    start_time = time.perf_counter_ns()
+    # Make the request through the identified/parsed proxy
+    async with session.get(request_url, proxy=proxy_url, headers=headers, timeout=current_timeout()) as response:
+        response.raise_for_status() # Raise a ClientResponseError for bad responses (4xx or 5xx)
 
+        # The test services return just "YOUR_IP" or a tiny JSON object; at most MAX_RESPONSE_BYTES are read,
+        # so a proxy answering with a captive portal or an HTML error page cannot make us pull a large body.
+        # read(n) returns whatever is buffered, so keep reading until the cap or EOF in case the body arrives split
+        body = b''
+        while len(body) < MAX_RESPONSE_BYTES and (chunk := await response.content.read(MAX_RESPONSE_BYTES - len(body))):
+            body += chunk
+    latency_ms = (time.perf_counter_ns() - start_time) / 1e6
+    # Parsed first, so captive portals (which tend to answer fast) never enter the latency window
+    public_ip = extract_public_ip(body)
+    record_latency(latency_ms)
+    return public_ip, latency_ms
+
+def parse_proxy(proxy_string):
+    """
+    Parses one proxy entry into a ParsedProxy, or returns None if the format is not recognised.
+    """
     original_proxy_string = proxy_string.strip()
-    proxies_dict = {}
-    parsed_protocol = "unknown" # To store the identified protocol
 
     # Attempt to parse common proxy formats:
     # 1. protocol://user:pass@ip:port
     # 2. protocol://ip:port
-    # 3. ip:port:user:pass (assume http/https)
-    # 4. ip:port (assume http/https)
+    # 3. ip:port:user:pass (assume http)
+    # 4. ip:port (assume http)
 
-    match_url = re.match(r'^(http|https|socks4|socks5):\/\/(?:([^:@]+):([^@]+)@)?([^:]+):(\d+)$', original_proxy_string)
+    match_url = _PROXY_RE.match(original_proxy_string)
     if match_url:
-        protocol_prefix, user, password, ip, port = match_url.groups()
+        protocol_prefix = match_url.group('proto').lower()
         parsed_protocol = protocol_prefix
-        if user and password:
-            auth_str = f"{user}:{password}@"
-        else:
-            auth_str = ""
-        full_proxy_url_for_requests = f"{protocol_prefix}://{auth_str}{ip}:{port}"
-
-        # requests library uses a single proxy string for http/https in the proxies dict,
-        # even if it's a socks proxy. It needs pysocks installed to handle socks.
-        proxies_dict = {
-            "http": full_proxy_url_for_requests,
-            "https": full_proxy_url_for_requests
-        }
+        # aiohttp_socks only knows http/socks4/socks5; an https:// proxy is reached with HTTP CONNECT
+        connector_protocol = "http" if protocol_prefix == "https" else protocol_prefix
     else:
         # Fallback for formats without explicit protocol or user:pass in URL form
-        parts = original_proxy_string.split(':')
-        if len(parts) == 2: # ip:port
-            ip, port = parts
-            parsed_protocol = "http_assumed"
-            proxies_dict = {
-                "http": f"http://{ip}:{port}",
-                "https": f"https://{ip}:{port}"
-            }
-        elif len(parts) == 4: # ip:port:user:pass
-            ip, port, user, password = parts
-            parsed_protocol = "http_auth_assumed"
-            proxies_dict = {
-                "http": f"http://{user}:{password}@{ip}:{port}",
-                "https": f"https://{user}:{password}@{ip}:{port}"
-            }
-        else:
-            return f"INVALID_FORMAT - {original_proxy_string}"
+        match_url = _BARE_RE.match(original_proxy_string)
+        if not match_url:
+            return None
+        connector_protocol = "http"
+        parsed_protocol = "http_auth_assumed" if match_url.group('user') else "http_assumed"
+
+    ip, port, user, password = match_url.group('ip', 'port', 'user', 'password')
+    # Canonical form, so entries that only differ in spelling (scheme given or not, https vs http,
+    # host name case, leading zeros in the port) produce the same proxy_url
+    ip, port = ip.lower(), int(port)
+    auth_str = f"{user}:{password}@" if user and password else ""
+    proxy_url = f"{connector_protocol}://{auth_str}{ip}:{port}"
+    return ParsedProxy(original_proxy_string, parsed_protocol.upper(), ip, port, proxy_url)
+
+async def probe_proxy(session, test_target, proxy_url=None):
+    """
+    Sends PROBES_PER_PROXY requests through one session, so later probes reuse the first probe's
+    connection to the proxy, and returns (public_ip, median latency in ms).
+    """
+    latencies = []
+    for _ in range(PROBES_PER_PROXY):
+        public_ip, latency_ms = await fetch_public_ip(session, test_target, proxy_url)
+        latencies.append(latency_ms)
+    return public_ip, statistics.median(latencies)
+
+async def test_proxy(proxy, session, semaphore, test_target):
+    """
+    Tests a single ParsedProxy against `test_target` regardless of its protocol (HTTP, HTTPS, SOCKS4, SOCKS5)
+    and handles authentication. HTTP proxies reuse the shared `session`;
+    `semaphore` caps how many tests run at once.
+    """
+    parsed_protocol, original_proxy_string, proxy_url = proxy.protocol, proxy.original, proxy.proxy_url
+
+    async with semaphore:
+        try:
+            # Stage 1: a bare TCP connect rejects dead proxies quickly, without any HTTP work
+            await check_reachable(proxy.ip, proxy.port)
+
+            # Stage 2: only reachable proxies get a real request through them
+            if proxy_url.startswith("socks"):
+                # SOCKS needs its own connector to route the traffic, so it gets a short-lived session
+                connector = ProxyConnector.from_url(proxy_url, ttl_dns_cache=300)
+                async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as socks_session:
+                    public_ip, latency_ms = await probe_proxy(socks_session, test_target)
+            else:
+                # HTTP proxies go through the shared session, whose pool keeps connections alive per proxy
+                public_ip, latency_ms = await probe_proxy(session, test_target, proxy_url)
+
+            return f"SUCCESS - {parsed_protocol} | {original_proxy_string} | Public IP: {public_ip} | Latency: {latency_ms:.0f}ms"
+
+        except Exception as e:
+            error_tag, detail = describe_error(e)
+            return f"{error_tag} - {parsed_protocol} | {original_proxy_string} | {detail}"
+
+async def iter_results(parsed_proxies, test_targets, concurrency=MAX_CONCURRENCY):
+    """
+    Tests every ParsedProxy concurrently on one event loop and yields each result as soon as it completes.
+    Proxies take turns over `test_targets`. Tests still running when the caller stops iterating are cancelled.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # One session with a pool sized to the concurrency limit, reused by every HTTP proxy test
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+        tasks = [asyncio.create_task(test_proxy(p, session, semaphore, target))
+                 for p, target in zip(parsed_proxies, itertools.cycle(test_targets))]
+        try:
+            # Fast proxies are reported right away instead of waiting behind slow ones
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# --- Multi-process Fan-out ---
+# How often (seconds) blocking waits on other processes wake up to check for finished or failed workers
+_POLL_INTERVAL = 0.2
 
+async def forward_results(shard, test_targets, concurrency, result_queue, stop_event, shared_timeout):
+    """
+    Tests one shard and puts each (result, new latencies) pair on `result_queue`. `stop_event` is watched
+    alongside the tests, so they are cancelled within _POLL_INTERVAL once it is set, even if no result
+    is due for a while. The adaptive timeout the parent publishes in `shared_timeout` is picked up as it changes.
+    """
+    async def forward():
+        async with aclosing(iter_results(shard, test_targets, concurrency)) as results_iterator:
+            async for result in results_iterator:
+                result_queue.put((result, take_unreported_latencies()))
+
+    forward_task = asyncio.create_task(forward())
+    while not forward_task.done():
+        await asyncio.wait({forward_task}, timeout=_POLL_INTERVAL)
+        if stop_event.is_set():
+            forward_task.cancel()
+            break
+        set_timeout(shared_timeout.value)
     try:
-        start_time = time.time()
-        # Make the request through the identified/parsed proxy
-        response = session.get(TEST_URL, proxies=proxies_dict, timeout=TIMEOUT)
-        end_time = time.time()
-        latency = end_time - start_time
-
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        # httpbin.org/ip returns {"origin": "YOUR_IP"}
-        public_ip = response.json().get('origin', 'N/A')
-
-        return f"SUCCESS - {parsed_protocol.upper()} | {original_proxy_string} | Public IP: {public_ip} | Latency: {latency:.2f}s"
-
-    except requests.exceptions.ProxyError as e:
-        return f"PROXY_ERROR - {parsed_protocol.upper()} | {original_proxy_string} | Check proxy configuration or if it's alive: {e}"
-    except requests.exceptions.ConnectionError as e:
-        return f"CONNECTION_ERROR - {parsed_protocol.upper()} | {original_proxy_string} | Proxy likely dead or blocked: {e}"
-    except requests.exceptions.Timeout:
-        return f"TIMEOUT - {parsed_protocol.upper()} | {original_proxy_string} | Proxy too slow or unresponsive"
-    except requests.exceptions.HTTPError as e:
-        return f"HTTP_ERROR - {parsed_protocol.upper()} | {original_proxy_string} | Status Code: {e.response.status_code} | Reason: {e.response.reason}"
-    except Exception as e:
-        return f"UNKNOWN_ERROR - {parsed_protocol.upper()} | {original_proxy_string} | An unexpected error occurred: {e}"
+        await forward_task
+    except asyncio.CancelledError:
+        pass
+
+def run_shard(shard, test_targets, concurrency, result_queue, stop_event, shared_timeout):
+    """
+    Entry point of a worker process: tests `shard` on the process's own event loop.
+    """
+    global _unreported_latencies
+    _unreported_latencies = [] # Latencies go to the parent instead of a per-worker window
+    run_event_loop(forward_results(shard, test_targets, concurrency, result_queue, stop_event, shared_timeout))
+
+async def iter_results_multiprocess(parsed_proxies, test_targets):
+    """
+    Splits the proxies into PROCESSES shards, tests each shard in its own worker process and
+    yields results as soon as any worker produces them. Workers stop early when the caller stops iterating.
+    Latencies from all workers feed this process's adaptive timeout, which is shared back with them.
+    """
+    shards = [shard for shard in (parsed_proxies[i::PROCESSES] for i in range(PROCESSES)) if shard]
+    concurrency = max(1, MAX_CONCURRENCY // len(shards))
+    loop = asyncio.get_running_loop()
+
+    # Spawned rather than forked: this process already runs threads (the output writer and
+    # the event loop's helper threads), and forking a multi-threaded process is unsafe
+    mp_context = multiprocessing.get_context('spawn')
+    manager = mp_context.Manager()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=len(shards), mp_context=mp_context)
+    result_queue = manager.Queue()
+    stop_event = manager.Event()
+    shared_timeout = manager.Value('d', current_timeout().total)
+    try:
+        futures = [executor.submit(run_shard, shard, test_targets, concurrency, result_queue, stop_event, shared_timeout)
+                   for shard in shards]
+        while True:
+            # The futures are watched as well as the queue, so a worker that dies without
+            # reporting back (killed, broken pool, unpicklable arguments) cannot hang this loop
+            done = [future for future in futures if future.done()]
+            for future in done:
+                future.result() # Re-raises the worker's exception, if any
+            try:
+                # Blocking queue reads happen in a helper thread so this event loop stays free
+                result, latencies = await loop.run_in_executor(None, result_queue.get, True, _POLL_INTERVAL)
+            except queue.Empty:
+                # Workers queue all of their results before finishing, so once every worker
+                # was done before this read, an empty queue means nothing is left
+                if len(done) == len(futures):
+                    break
+                continue
+
+            published_timeout = current_timeout().total
+            for latency_ms in latencies:
+                record_latency(latency_ms)
+            if current_timeout().total != published_timeout:
+                shared_timeout.value = current_timeout().total
+            yield result
+    finally:
+        stop_event.set()
+        # Waiting for the workers to wind down happens in helper threads so this event loop stays free
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        await asyncio.to_thread(manager.shutdown)
+
+# --- Output ---
+@contextmanager
+def saving_results():
+    """
+    Turns an OSError raised by the result file operations inside the block into ResultsFileError.
+    """
+    try:
+        yield
+    except OSError as e:
+        raise ResultsFileError(e) from e
+
+def write_output(output_queue):
+    """
+    Runs in a dedicated thread: drains `output_queue` to stdout until it receives None.
+    Lines are written in batches of up to OUTPUT_BATCH_SIZE, or as soon as the queue runs empty.
+    """
+    out_buf = []
+    while True:
+        line = output_queue.get()
+        if line is None:
+            break
+        out_buf.append(line)
+        if len(out_buf) >= OUTPUT_BATCH_SIZE or output_queue.empty():
+            sys.stdout.write(''.join(out_buf))
+            sys.stdout.flush()
+            out_buf.clear()
+    sys.stdout.write(''.join(out_buf))
+    sys.stdout.flush()
+
+async def main(parsed_proxies, test_targets, invalid_results, working_file, failed_file):
+    """
+    Runs the tests, printing progress and writing each result to `working_file` or `failed_file`
+    as it arrives; the INVALID_FORMAT lines in `invalid_results` are reported first.
+    Stops early once TARGET_WORKING proxies work. Returns (tested_count, working_count, failed_count).
+    """
+    # Progress lines go through a queue to a writer thread, so a slow terminal never stalls the event loop.
+    # The thread is a daemon and everything after its start is inside the try, so it can never keep the
+    # process alive: the finally always sends it the None that ends it.
+    output_queue = queue.Queue()
+    output_thread = threading.Thread(target=write_output, args=(output_queue,), daemon=True)
+    output_thread.start()
+    try:
+        total = len(invalid_results) + len(parsed_proxies)
+        with saving_results():
+            failed_file.writelines(f"{result}\n" for result in invalid_results)
+        for i, result in enumerate(invalid_results, 1):
+            output_queue.put(f"[{i}/{total}] {result}\n")
+        tested_count = failed_count = len(invalid_results)
+        working_count = 0
+
+        if PROCESSES > 1 and len(parsed_proxies) > 1:
+            results_source = iter_results_multiprocess(parsed_proxies, test_targets)
+        else:
+            results_source = iter_results(parsed_proxies, test_targets)
+
+        async with aclosing(results_source) as results_iterator:
+            async for result in results_iterator:
+                tested_count += 1
+                output_queue.put(f"[{tested_count}/{total}] {result}\n")
+
+                if result.startswith("SUCCESS"):
+                    with saving_results():
+                        working_file.write(result + '\n')
+                    working_count += 1
+                    if TARGET_WORKING and working_count >= TARGET_WORKING:
+                        output_queue.put(f"Found {working_count} working proxies, stopping early.\n")
+                        break
+                else:
+                    with saving_results():
+                        failed_file.write(result + '\n')
+                    failed_count += 1
+    finally:
+        output_queue.put(None)
+        await asyncio.to_thread(output_thread.join)
+    return tested_count, working_count, failed_count
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -111,41 +564,62 @@ if __name__ == "__main__":
 
     print(f"Loaded {len(proxies_to_test)} proxies from '{proxy_list_file}'. Starting test...")
 
-    working_proxies = []
-    failed_proxies = []
-
-    # Use ThreadPoolExecutor for concurrent testing
-    # This will significantly speed up testing 1.5k proxies
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Map the test_proxy function to each proxy string
-        # `executor.map` returns results in the order the inputs were submitted
-        results_iterator = executor.map(test_proxy, proxies_to_test)
+    # Parse every entry once before testing; unrecognised entries are reported straight away
+    parsed_proxies = []
+    invalid_results = []
+    for proxy_string in proxies_to_test:
+        parsed = parse_proxy(proxy_string)
+        if parsed:
+            parsed_proxies.append(parsed)
+        else:
+            invalid_results.append(f"INVALID_FORMAT - {proxy_string}")
 
-        for i, result in enumerate(results_iterator):
-            print(f"[{i+1}/{len(proxies_to_test)}] {result}")
-            if result.startswith("SUCCESS"):
-                working_proxies.append(result)
-            else:
-                failed_proxies.append(result)
+    # Resolve host names once here instead of on every request
+    test_targets = resolve_test_urls(TEST_URLS)
+    if not test_targets:
+        print("Error: none of the test URLs could be resolved. Check your DNS / network connection.")
+        exit(1)
+    parsed_proxies = resolve_proxy_hosts(parsed_proxies)
 
-    print("\n--- Test Complete ---")
-    print(f"Total Proxies Tested: {len(proxies_to_test)}")
-    print(f"Working Proxies: {len(working_proxies)}")
-    print(f"Failed Proxies: {len(failed_proxies)}")
+    # Skip entries that are the same proxy as an earlier one. This runs after resolution,
+    # so "host:port" and "<its ip>:port" count as the same proxy too.
+    seen_proxy_urls = set()
+    unique_proxies = []
+    for parsed in parsed_proxies:
+        if parsed.proxy_url not in seen_proxy_urls:
+            seen_proxy_urls.add(parsed.proxy_url)
+            unique_proxies.append(parsed)
+    if len(unique_proxies) < len(parsed_proxies):
+        print(f"Skipped {len(parsed_proxies) - len(unique_proxies)} duplicate proxies.")
+    parsed_proxies = unique_proxies
 
-    # Optional: Save results to files
-    print("\nSaving results...")
+    # Results are written to these files as they arrive, so no post-processing pass is needed.
+    # Only errors from the files themselves are reported as save errors; any other error from the run propagates.
     try:
-        with open('working_proxies_output.txt', 'w') as f_out:
-            for p in working_proxies:
-                f_out.write(p + '\n')
-        print("Working proxies saved to 'working_proxies_output.txt'")
-
-        with open('failed_proxies_output.txt', 'w') as f_out:
-            for p in failed_proxies:
-                f_out.write(p + '\n')
-        print("Failed proxies saved to 'failed_proxies_output.txt'")
-    except IOError as e:
+        with saving_results():
+            working_file = open('working_proxies_output.txt', 'w', buffering=1 << 16)
+            failed_file = open('failed_proxies_output.txt', 'w', buffering=1 << 16)
+        try:
+            # Run every test on a single asyncio event loop
+            # This multiplexes all 1.5k proxies without a thread per in-flight request
+            # Results are reported in the order they complete, not the order they were submitted
+            tested_count, working_count, failed_count = run_event_loop(
+                main(parsed_proxies, test_targets, invalid_results, working_file, failed_file))
+        finally:
+            # Closing flushes the write buffers, so it can fail like a write
+            with saving_results():
+                working_file.close()
+                failed_file.close()
+    except ResultsFileError as e:
         print(f"Error saving results to file: {e}")
+        exit(1)
+
+    print("\n--- Test Complete ---")
+    print(f"Total Proxies Tested: {tested_count}")
+    print(f"Working Proxies: {working_count}")
+    print(f"Failed Proxies: {failed_count}")
+
+    print("\nWorking proxies saved to 'working_proxies_output.txt'")
+    print("Failed proxies saved to 'failed_proxies_output.txt'")
 
     print("\nDone.")